@@ -3,9 +3,21 @@ import os
 import time
 import re
 import logging
+import functools
+import concurrent.futures
 from pathlib import Path
 from datetime import datetime, timezone
 
+# Supported SoC codes, listed in detection priority order
+_PLATFORM_CODES = ("sm8550", "sm8450", "sm8250")
+_PLATFORM_RE = re.compile(r"sm8(?:550|450|250)")
+
+@functools.lru_cache(maxsize=None)
+def _load_json(path_str: str) -> dict:
+    """Load a JSON config once per process, callers must not mutate the result"""
+    with open(path_str, 'r') as f:
+        return json.load(f)
+
 class PropertyModifier:
     def __init__(self, context):
         """
@@ -22,8 +34,22 @@ class PropertyModifier:
         """Execute all property modification logic"""
         self.logger.info("Starting build.prop modifications...")
         
-        # 1. Global replacement (time, code, fingerprint, etc.)
-        self._update_general_info()
+        # Walk the target tree once, every build.prop pass below reuses this list
+        # os.walk uses scandir d_type, so directories are told apart without a stat per entry
+        self._build_props = [
+            Path(root) / "build.prop"
+            for root, _, files in os.walk(self.ctx.target_dir)
+            if "build.prop" in files
+        ]
+        
+        # 1. Global replacement (time, code, etc.) + fingerprint regeneration
+        # Both are fused into one rewrite: read every file once, compute the fingerprint
+        # from the in-memory props with the general overrides applied, then write once.
+        prop_contents = self._read_build_props()
+        general_replacements, remove_keys = self._update_general_info()
+        
+        fingerprint_replacements = self._regenerate_fingerprint(prop_contents, general_replacements)
+        self._rewrite_build_props(prop_contents, {**general_replacements, **fingerprint_replacements}, remove_keys)
         
         # 2. Screen density (DPI) migration
         self._update_density()
@@ -31,14 +57,16 @@ class PropertyModifier:
         # 3. Apply specific fixes (Millet, Blur, Cgroup)
         self._apply_specific_fixes()
         
-        self._regenerate_fingerprint()
-        
         self._optimize_core_affinity()
         
         self.logger.info("Build.prop modifications completed.")
 
-    def _update_general_info(self):
-        """Modified to load from devices/common/props_global.json"""
+    def _update_general_info(self) -> tuple[dict, set]:
+        """
+        Modified to load from devices/common/props_global.json
+        Returns (replacements, remove_keys): the replacement map (key -> "key=value")
+        and the keys to drop; both are empty if the config is unavailable
+        """
         
         # Generate timestamp
         now = datetime.now(timezone.utc)
@@ -54,18 +82,17 @@ class PropertyModifier:
         config_path = Path("devices/common/props_global.json")
         if not config_path.exists():
             self.logger.warning("props_global.json not found, skipping general info update.")
-            return
+            return {}, set()
 
         try:
-            with open(config_path, 'r') as f:
-                config = json.load(f)
+            config = _load_json(str(config_path.resolve()))
         except Exception as e:
             self.logger.error(f"Failed to load props_global.json: {e}")
-            return
+            return {}, set()
 
         # Prepare replacements
         # 1. Common
-        replacements = config.get("common", {})
+        replacements = dict(config.get("common", {}))
         
         # 2. EU vs CN
         is_eu = getattr(self.ctx, "is_port_eu_rom", False)
@@ -85,51 +112,88 @@ class PropertyModifier:
         }
         
         # Build final key-value map for processing
+        # The map expects: "key": "key=value"
         final_replacements = {}
         for k, v in replacements.items():
             formatted_val = v.format(**fmt_map)
-            # The map expects: "key=": "key=value"
-            final_replacements[f"{k}="] = f"{k}={formatted_val}"
-
-        # Iterate all build.prop and modify
-        for prop_file in self.ctx.target_dir.rglob("build.prop"):
-            lines = []
-            with open(prop_file, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
+            final_replacements[k] = f"{k}={formatted_val}"
+
+        # Stock density scale does not apply to the ported ROM
+        return final_replacements, {"ro.miui.density.primaryscale"}
+
+    def _for_each_build_prop(self, func, *args) -> list:
+        """
+        Run func(prop_file, *args) on every build.prop concurrently
+        Files are edited independently and the work is I/O bound, so threads overlap well
+        """
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda prop_file: func(prop_file, *args), self._build_props))
+
+    def _read_build_props(self) -> dict:
+        """Read every build.prop once, returns {path: lines}"""
+        def read_lines(prop_file):
+            try:
+                return prop_file.read_text(encoding='utf-8', errors='ignore').splitlines(keepends=True)
+            except OSError as e:
+                self.logger.warning(f"Failed to read {prop_file}: {e}")
+                return None
+
+        results = self._for_each_build_prop(read_lines)
+        return {
+            prop_file: lines
+            for prop_file, lines in zip(self._build_props, results)
+            if lines is not None
+        }
+
+    def _rewrite_build_props(self, prop_contents: dict, replacements: dict, remove_keys=frozenset()):
+        """
+        Rewrite all build.prop files in a single pass
+        :param prop_contents: Map of path -> lines, as returned by _read_build_props
+        :param replacements: Map of prop key -> full replacement line ("key=value")
+        :param remove_keys: Prop keys whose lines should be deleted
+        """
+        self._for_each_build_prop(self._rewrite_prop_file, prop_contents, replacements, remove_keys)
+
+    def _rewrite_prop_file(self, prop_file: Path, prop_contents: dict, replacements: dict, remove_keys):
+        """Apply replacements/removals to one build.prop, writing back only if changed"""
+        lines = prop_contents.get(prop_file)
+        if lines is None:
+            return
+
+        new_lines = []
+        file_changed = False
+        for line in lines:
+            stripped = line.strip()
+            # One C-level partition per line, the key then dispatches via a single dict lookup
+            key, sep, _ = stripped.partition("=")
+            if not sep:
+                new_lines.append(line)
+                continue
             
-            new_lines = []
-            file_changed = False
-            for line in lines:
-                original_line = line
-                line = line.strip()
-                
-                # 1. Dictionary replacement logic
-                replaced = False
-                for prefix, new_val in final_replacements.items():
-                    if line.startswith(prefix):
-                        if original_line.strip() != new_val:
-                            self.logger.debug(f"[{prop_file.name}] Replace: {line} -> {new_val}")
-                            new_lines.append(new_val + "\n")
-                            file_changed = True
-                        else:
-                             new_lines.append(original_line)
-                        replaced = True
-                        break
-                if replaced: continue
-
-                # 2. Delete logic
-                if line.startswith("ro.miui.density.primaryscale="):
-                    self.logger.debug(f"[{prop_file.name}] Remove: {line}")
+            # 1. Dictionary replacement logic
+            new_val = replacements.get(key)
+            if new_val is not None:
+                if stripped != new_val:
+                    self.logger.debug(f"[{prop_file.name}] Replace: {stripped} -> {new_val}")
+                    new_lines.append(new_val + "\n")
                     file_changed = True
-                    continue
+                else:
+                    new_lines.append(line)
+                continue
 
-                new_lines.append(original_line)
-            
-            # Write back file
-            if file_changed:
-                self.logger.debug(f"Writing changes to {prop_file.relative_to(self.ctx.target_dir)}")
-                with open(prop_file, 'w', encoding='utf-8') as f:
-                    f.writelines(new_lines)
+            # 2. Delete logic
+            if key in remove_keys:
+                self.logger.debug(f"[{prop_file.name}] Remove: {stripped}")
+                file_changed = True
+                continue
+
+            new_lines.append(line)
+        
+        # Write back file
+        if file_changed:
+            self.logger.debug(f"Writing changes to {prop_file.relative_to(self.ctx.target_dir)}")
+            prop_file.write_text("".join(new_lines), encoding='utf-8')
 
     def _update_density(self):
         """Screen density modification"""
@@ -150,26 +214,7 @@ class PropertyModifier:
             self.logger.info(f"Found Base density: {base_density}")
 
         # 2. Modify porting package
-        found_in_port = False
-        target_props = list(self.ctx.target_dir.rglob("build.prop"))
-        
-        for prop_file in target_props:
-            content = prop_file.read_text(encoding='utf-8', errors='ignore')
-            new_content = content
-            
-            # Replace ro.sf.lcd_density
-            if "ro.sf.lcd_density=" in content:
-                self.logger.debug(f"[{prop_file.name}] Updating ro.sf.lcd_density to {base_density}")
-                new_content = re.sub(r"ro\.sf\.lcd_density=.*", f"ro.sf.lcd_density={base_density}", new_content)
-                found_in_port = True
-            
-            # Replace persist.miui.density_v2
-            if "persist.miui.density_v2=" in content:
-                 self.logger.debug(f"[{prop_file.name}] Updating persist.miui.density_v2 to {base_density}")
-                 new_content = re.sub(r"persist\.miui\.density_v2=.*", f"persist.miui.density_v2={base_density}", new_content)
-            
-            if content != new_content:
-                prop_file.write_text(new_content, encoding='utf-8')
+        found_in_port = any(self._for_each_build_prop(self._update_density_file, base_density))
 
         # 3. If not found, append to product/etc/build.prop
         if not found_in_port:
@@ -181,14 +226,43 @@ class PropertyModifier:
             else:
                 self.logger.warning(f"Could not find product/etc/build.prop to append density.")
 
+    def _update_density_file(self, prop_file: Path, base_density: str) -> bool:
+        """Update density props in one file, returns True if ro.sf.lcd_density was present"""
+        # Most files carry neither key, skip them before paying for the decode
+        raw = prop_file.read_bytes()
+        if b"ro.sf.lcd_density=" not in raw and b"persist.miui.density_v2=" not in raw:
+            return False
+        
+        found = False
+        content = raw.decode('utf-8', errors='ignore')
+        lines = content.splitlines(keepends=True)
+        
+        for i, line in enumerate(lines):
+            # Replace ro.sf.lcd_density
+            if line.startswith("ro.sf.lcd_density="):
+                self.logger.debug(f"[{prop_file.name}] Updating ro.sf.lcd_density to {base_density}")
+                lines[i] = f"ro.sf.lcd_density={base_density}\n"
+                found = True
+            # Replace persist.miui.density_v2
+            elif line.startswith("persist.miui.density_v2="):
+                self.logger.debug(f"[{prop_file.name}] Updating persist.miui.density_v2 to {base_density}")
+                lines[i] = f"persist.miui.density_v2={base_density}\n"
+        
+        new_content = "".join(lines)
+        if content != new_content:
+            prop_file.write_text(new_content, encoding='utf-8')
+        return found
+
     def _apply_specific_fixes(self):
         """Device-specific fixes (Millet, Blur, Cgroup, etc.)"""
         self.logger.info("Applying device-specific fixes...")
 
-        # --- 1. cust_erofs ---
+        # Product fixes are collected and applied with a single read/write
         product_prop = self.ctx.target_dir / "product/etc/build.prop"
-        if product_prop.exists():
-            self._update_or_append_prop(product_prop, "ro.miui.cust_erofs", "0")
+        product_fixes = {}
+
+        # --- 1. cust_erofs ---
+        product_fixes["ro.miui.cust_erofs"] = "0"
 
         # --- 2. Millet Fix ---
         millet_ver = self.ctx.stock.get_prop("ro.millet.netlink")
@@ -198,11 +272,13 @@ class PropertyModifier:
         else:
             self.logger.debug(f"Found base millet version: {millet_ver}")
         
-        self._update_or_append_prop(product_prop, "ro.millet.netlink", millet_ver)
+        product_fixes["ro.millet.netlink"] = millet_ver
 
         # --- 3. Blur Fix ---
-        self._update_or_append_prop(product_prop, "persist.sys.background_blur_supported", "true")
-        self._update_or_append_prop(product_prop, "persist.sys.background_blur_version", "2")
+        product_fixes["persist.sys.background_blur_supported"] = "true"
+        product_fixes["persist.sys.background_blur_version"] = "2"
+
+        self._batch_update_props(product_prop, product_fixes)
 
         # --- 4. Vendor Fixes (Cgroup) ---
         vendor_prop = self.ctx.target_dir / "vendor/build.prop"
@@ -213,53 +289,72 @@ class PropertyModifier:
                 content = content.replace("persist.sys.millet.cgroup1", "#persist.sys.millet.cgroup1")
                 vendor_prop.write_text(content, encoding='utf-8')
 
-    def _update_or_append_prop(self, file_path: Path, key: str, value: str):
-        """Helper function: update or append property"""
+    def _batch_update_props(self, file_path: Path, kvs: dict):
+        """Helper function: update or append several properties with one read and one write"""
         if not file_path.exists(): return
         
         content = file_path.read_text(encoding='utf-8', errors='ignore')
-        pattern = f"{re.escape(key)}=.*"
-        replacement = f"{key}={value}"
+        lines = content.splitlines(keepends=True)
         
-        match = re.search(pattern, content)
-        if match:
-            if match.group(0) != replacement:
-                self.logger.debug(f"[{file_path.name}] Update: {key} -> {value}")
-                new_content = re.sub(pattern, replacement, content)
-                file_path.write_text(new_content, encoding='utf-8')
-        else:
-            self.logger.debug(f"[{file_path.name}] Append: {key}={value}")
-            new_content = content + f"\n{replacement}\n"
+        found = set()
+        for i, line in enumerate(lines):
+            key, sep, _ = line.partition("=")
+            if sep and key in kvs:
+                found.add(key)
+                replacement = f"{key}={kvs[key]}\n"
+                if line != replacement:
+                    self.logger.debug(f"[{file_path.name}] Update: {key} -> {kvs[key]}")
+                    lines[i] = replacement
+        
+        missing = [key for key in kvs if key not in found]
+        if missing:
+            for key in missing:
+                self.logger.debug(f"[{file_path.name}] Append: {key}={kvs[key]}")
+            lines.append("\n" + "".join(f"{key}={kvs[key]}\n" for key in missing))
+        
+        new_content = "".join(lines)
+        if new_content != content:
             file_path.write_text(new_content, encoding='utf-8')
     
-    def _regenerate_fingerprint(self):
+    def _regenerate_fingerprint(self, prop_contents: dict, overrides: dict) -> dict:
         """
         Regenerate ro.build.fingerprint and ro.build.description based on modified properties
         Format: Brand/Name/Device:Release/ID/Incremental:Type/Tags
+        :param prop_contents: Map of path -> lines, as returned by _read_build_props
+        :param overrides: Pending replacements (key -> "key=value") not yet written to disk
+        Returns the fingerprint/description replacement map
         """
         self.logger.info("Regenerating build fingerprint...")
 
-        def get_current_prop(key, default=""):
-            # Priority: product -> system -> vendor
-            for part in ["product", "system", "vendor","mi_ext"]:
-                for prop_file in (self.ctx.target_dir / part).rglob("build.prop"):
-                    try:
-                        with open(prop_file, 'r', errors='ignore') as f:
-                            for line in f:
-                                if line.strip().startswith(f"{key}="):
-                                    return line.split("=", 1)[1].strip()
-                    except: pass
-            return default
+        # Index all props once, first value wins so partition priority is respected
+        # Priority: product -> system -> vendor -> mi_ext
+        props_by_part = {}
+        for prop_file in self._build_props:
+            part = prop_file.relative_to(self.ctx.target_dir).parts[0]
+            props_by_part.setdefault(part, []).append(prop_file)
+
+        prop_index = {}
+        for part in ["product", "system", "vendor", "mi_ext"]:
+            for prop_file in props_by_part.get(part, []):
+                for line in prop_contents.get(prop_file, []):
+                    key, sep, value = line.strip().partition("=")
+                    if sep:
+                        prop_index.setdefault(key, value.strip())
+
+        # Pending overrides replace every existing occurrence, so they win wherever indexed
+        for key, new_line in overrides.items():
+            if key in prop_index:
+                prop_index[key] = new_line.split("=", 1)[1].strip()
 
         # Read components
-        brand = get_current_prop("ro.product.brand", "Xiaomi")
-        name = get_current_prop("ro.product.mod_device")
-        device = get_current_prop("ro.product.device", "miproduct")
-        version = get_current_prop("ro.build.version.release")
-        build_id = get_current_prop("ro.build.id")
-        incremental = get_current_prop("ro.build.version.incremental")
-        build_type = get_current_prop("ro.build.type", "user")
-        tags = get_current_prop("ro.build.tags", "release-keys")
+        brand = prop_index.get("ro.product.brand", "Xiaomi")
+        name = prop_index.get("ro.product.mod_device", "")
+        device = prop_index.get("ro.product.device", "miproduct")
+        version = prop_index.get("ro.build.version.release", "")
+        build_id = prop_index.get("ro.build.id", "")
+        incremental = prop_index.get("ro.build.version.incremental", "")
+        build_type = prop_index.get("ro.build.type", "user")
+        tags = prop_index.get("ro.build.tags", "release-keys")
 
         self.logger.debug(f"Fingerprint components: Brand={brand}, Name={name}, Device={device}, Ver={version}, ID={build_id}, Inc={incremental}")
 
@@ -272,49 +367,19 @@ class PropertyModifier:
         self.logger.debug(f"New Description: {new_description}")
 
         # Write to all build.prop files
-        replacements = {
-            "ro.build.fingerprint=": f"ro.build.fingerprint={new_fingerprint}",
-            "ro.bootimage.build.fingerprint=": f"ro.bootimage.build.fingerprint={new_fingerprint}",
-            "ro.system.build.fingerprint=": f"ro.system.build.fingerprint={new_fingerprint}",
-            "ro.product.build.fingerprint=": f"ro.product.build.fingerprint={new_fingerprint}",
-            "ro.system_ext.build.fingerprint=": f"ro.system_ext.build.fingerprint={new_fingerprint}",
-            "ro.vendor.build.fingerprint=": f"ro.vendor.build.fingerprint={new_fingerprint}",
-            "ro.odm.build.fingerprint=": f"ro.odm.build.fingerprint={new_fingerprint}",
+        return {
+            "ro.build.fingerprint": f"ro.build.fingerprint={new_fingerprint}",
+            "ro.bootimage.build.fingerprint": f"ro.bootimage.build.fingerprint={new_fingerprint}",
+            "ro.system.build.fingerprint": f"ro.system.build.fingerprint={new_fingerprint}",
+            "ro.product.build.fingerprint": f"ro.product.build.fingerprint={new_fingerprint}",
+            "ro.system_ext.build.fingerprint": f"ro.system_ext.build.fingerprint={new_fingerprint}",
+            "ro.vendor.build.fingerprint": f"ro.vendor.build.fingerprint={new_fingerprint}",
+            "ro.odm.build.fingerprint": f"ro.odm.build.fingerprint={new_fingerprint}",
             
-            "ro.build.description=": f"ro.build.description={new_description}",
-            "ro.system.build.description=": f"ro.system.build.description={new_description}"
+            "ro.build.description": f"ro.build.description={new_description}",
+            "ro.system.build.description": f"ro.system.build.description={new_description}"
         }
 
-        for prop_file in self.ctx.target_dir.rglob("build.prop"):
-            lines = []
-            try:
-                with open(prop_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    lines = f.readlines()
-            except: continue
-
-            new_lines = []
-            file_changed = False
-            for line in lines:
-                original = line
-                line = line.strip()
-                replaced = False
-                for prefix, new_val in replacements.items():
-                    if line.startswith(prefix):
-                        if original.strip() != new_val:
-                            new_lines.append(new_val + "\n")
-                            file_changed = True
-                        else:
-                            new_lines.append(original)
-                        replaced = True
-                        break
-                if not replaced:
-                    new_lines.append(original)
-            
-            if file_changed:
-                self.logger.debug(f"Updated fingerprint in {prop_file.relative_to(self.ctx.target_dir)}")
-                with open(prop_file, 'w', encoding='utf-8') as f:
-                    f.writelines(new_lines)    
-
     def _optimize_core_affinity(self):
         """
         Core allocation and scheduler optimization (supports sm8250, sm8450, sm8550 and Android version differences)
@@ -333,9 +398,10 @@ class PropertyModifier:
             if vendor_prop.exists():
                 try:
                     content = vendor_prop.read_text(encoding='utf-8', errors='ignore')
-                    if "sm8550" in content: return "sm8550"
-                    if "sm8450" in content: return "sm8450"
-                    if "sm8250" in content: return "sm8250"
+                    # One scan collects every code, priority is resolved afterwards
+                    found = set(_PLATFORM_RE.findall(content))
+                    for code in _PLATFORM_CODES:
+                        if code in found: return code
                 except: pass
             return "unknown"
 
@@ -346,8 +412,7 @@ class PropertyModifier:
             config = {}
         else:
             try:
-                with open(config_path, 'r') as f:
-                    config = json.load(f)
+                config = _load_json(str(config_path.resolve()))
             except Exception as e:
                 self.logger.error(f"Failed to load scheduler.json: {e}")
                 return
@@ -371,5 +436,4 @@ class PropertyModifier:
         # 5. Batch apply
         if target_props:
             self.logger.debug(f"Applying {len(target_props)} scheduling properties...")
-            for key, value in target_props.items():
-                self._update_or_append_prop(product_prop, key, value)
+            self._batch_update_props(product_prop, target_props)
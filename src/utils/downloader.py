@@ -5,10 +5,14 @@ import zipfile
 import tarfile
 import os
 import re
+import sys
 import urllib.request
 from pathlib import Path
 from src.utils.shell import ShellRunner
 
+# Copy buffer for archive download/extraction (1 MiB)
+COPY_BUFSIZE = 1024 * 1024
+
 class Aria2Manager:
     def __init__(self):
         self.logger = logging.getLogger("Aria2Mgr")
@@ -67,7 +71,7 @@ class Aria2Manager:
         try:
             self.logger.info(f"Downloading from {download_url}...")
             with urllib.request.urlopen(download_url) as response, open(archive_path, 'wb') as out_file:
-                shutil.copyfileobj(response, out_file)
+                shutil.copyfileobj(response, out_file, length=COPY_BUFSIZE)
             
             self.logger.info("Extracting...")
             extracted_bin = None
@@ -76,8 +80,8 @@ class Aria2Manager:
                 with zipfile.ZipFile(archive_path, 'r') as z:
                     for name in z.namelist():
                         if name.endswith("aria2c.exe"):
-                            with open(self.local_bin, 'wb') as f_out:
-                                f_out.write(z.read(name))
+                            with z.open(name) as f_in, open(self.local_bin, 'wb') as f_out:
+                                shutil.copyfileobj(f_in, f_out, length=COPY_BUFSIZE)
                             extracted_bin = self.local_bin
                             break
             else:
@@ -86,7 +90,7 @@ class Aria2Manager:
                         if member.name.endswith("aria2c"):
                             f_in = t.extractfile(member)
                             with open(self.local_bin, 'wb') as f_out:
-                                shutil.copyfileobj(f_in, f_out)
+                                shutil.copyfileobj(f_in, f_out, length=COPY_BUFSIZE)
                             extracted_bin = self.local_bin
                             break
             
@@ -159,11 +163,13 @@ class RomDownloader:
             url
         ]
         
+        # Without a TTY (CI logs) the progress readout is just noise redrawn every tick
+        if not sys.stdout.isatty():
+            cmd[1:1] = ["--show-console-readout=false", "--summary-interval=0"]
+        
         try:
-            # We want to see download progress, so we don't capture output usually,
-            # but ShellRunner might capture it. Ideally we stream it.
-            # Using ShellRunner with check=True. 
-            # Note: aria2c output is verbose.
+            # ShellRunner does not capture output by default, so aria2c
+            # inherits our stdout and streams progress directly.
             self.shell.run(cmd, check=True)
             
             if not target_path.exists():
@@ -0,0 +1,134 @@
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+from pathlib import Path
+from src.core.props import PropertyModifier, _load_json
+
+@pytest.fixture
+def prop_env(mock_context, tmp_path, monkeypatch):
+    """Creates a minimal target tree with build.prop files and a props_global.json."""
+    # props_global.json is resolved relative to CWD
+    monkeypatch.chdir(tmp_path)
+    config_dir = tmp_path / "devices" / "common"
+    config_dir.mkdir(parents=True)
+    (config_dir / "props_global.json").write_text(json.dumps({
+        "common": {"ro.build.user": "{build_user}"},
+        "cn_rom": {"ro.build.version.incremental": "{rom_version}"},
+        "eu_rom": {"ro.build.version.incremental": "{rom_version}.EU"}
+    }))
+
+    target_dir = tmp_path / "target"
+    product_prop = target_dir / "product" / "etc" / "build.prop"
+    system_prop = target_dir / "system" / "system" / "build.prop"
+    vendor_prop = target_dir / "vendor" / "build.prop"
+    for prop in (product_prop, system_prop, vendor_prop):
+        prop.parent.mkdir(parents=True)
+
+    product_prop.write_text(
+        "# product props\n"
+        "ro.product.brand=Xiaomi\n"
+        "ro.product.mod_device=fuxi\n"
+        "ro.product.device=fuxi\n"
+        "ro.build.user=builder\n"
+        "ro.miui.density.primaryscale=3\n"
+        "ro.sf.lcd_density=440\n"
+        "ro.product.build.fingerprint=old\n"
+    )
+    system_prop.write_text(
+        "ro.build.version.release=14\n"
+        "ro.build.id=UKQ1\n"
+        "ro.build.version.incremental=OS1.0.1.0\n"
+        "ro.build.type=user\n"
+        "ro.build.tags=release-keys\n"
+        "ro.system.build.fingerprint=old\n"
+        "ro.build.description=old\n"
+    )
+    vendor_prop.write_text(
+        "ro.board.platform=kalama\n"
+        "ro.vendor.qti.soc_model=sm8550\n"
+        "persist.sys.millet.cgroup1=true\n"
+    )
+
+    ctx = mock_context
+    ctx.target_dir = target_dir
+    ctx.stock_rom_code = "fuxi"
+    ctx.target_rom_version = "OS2.0.1.0"
+    ctx.is_port_eu_rom = False
+    ctx.port_android_version = "14"
+    stock_props = {"ro.sf.lcd_density": "480", "ro.millet.netlink": "30"}
+    ctx.stock = MagicMock()
+    ctx.stock.get_prop.side_effect = lambda key, default=None: stock_props.get(key, default)
+
+    return {
+        "ctx": ctx,
+        "product": product_prop,
+        "system": system_prop,
+        "vendor": vendor_prop,
+    }
+
+def read_props(path):
+    return path.read_text().splitlines()
+
+def test_general_info_replaces_and_removes(prop_env):
+    PropertyModifier(prop_env["ctx"]).run()
+
+    product = read_props(prop_env["product"])
+    system = read_props(prop_env["system"])
+    assert "ro.build.user=Bruce" in product
+    assert not any(l.startswith("ro.miui.density.primaryscale=") for l in product)
+    assert "ro.build.version.incremental=OS2.0.1.0" in system
+    # Comments and untouched props are preserved
+    assert product[0] == "# product props"
+    assert "ro.product.device=fuxi" in product
+
+def test_density_and_specific_fixes(prop_env):
+    PropertyModifier(prop_env["ctx"]).run()
+
+    product = read_props(prop_env["product"])
+    assert "ro.sf.lcd_density=480" in product
+    assert "ro.miui.cust_erofs=0" in product
+    assert "ro.millet.netlink=30" in product
+    assert "persist.sys.background_blur_supported=true" in product
+    assert "persist.sys.background_blur_version=2" in product
+    assert "#persist.sys.millet.cgroup1=true" in read_props(prop_env["vendor"])
+
+def test_fingerprint_uses_updated_props(prop_env):
+    PropertyModifier(prop_env["ctx"]).run()
+
+    fingerprint = "Xiaomi/fuxi/fuxi:14/UKQ1/OS2.0.1.0:user/release-keys"
+    assert f"ro.product.build.fingerprint={fingerprint}" in read_props(prop_env["product"])
+    system = read_props(prop_env["system"])
+    assert f"ro.system.build.fingerprint={fingerprint}" in system
+    assert "ro.build.description=fuxi-user 14 UKQ1 OS2.0.1.0 release-keys" in system
+
+def test_unchanged_files_are_not_rewritten(prop_env):
+    modifier = PropertyModifier(prop_env["ctx"])
+    modifier.run()
+
+    modifier._build_props = [prop_env["system"]]
+    with patch.object(Path, "write_text") as mock_write:
+        modifier._rewrite_build_props(modifier._read_build_props(), {"ro.build.id": "ro.build.id=UKQ1"})
+
+    mock_write.assert_not_called()
+
+def test_cached_config_is_not_mutated(prop_env):
+    prop_env["ctx"].is_port_eu_rom = True
+    PropertyModifier(prop_env["ctx"]).run()
+    assert "ro.build.version.incremental=OS2.0.1.0.EU" in read_props(prop_env["system"])
+
+    # EU overrides must not leak into the cached "common" section
+    config = _load_json(str(Path("devices/common/props_global.json").resolve()))
+    assert config["common"] == {"ro.build.user": "{build_user}"}
+
+def test_core_affinity_batches_platform_props(prop_env):
+    (Path("devices/common") / "scheduler.json").write_text(json.dumps({
+        "sm8550": {"persist.sys.miui_animator_sched.bigcores": "3-6", "ro.millet.netlink": "31"},
+        "default": {"persist.sys.miui_animator_sched.bigcores": "4-7"}
+    }))
+    PropertyModifier(prop_env["ctx"]).run()
+
+    product = read_props(prop_env["product"])
+    assert "persist.sys.miui_animator_sched.bigcores=3-6" in product
+    # Existing keys are updated in place rather than appended twice
+    assert product.count("ro.millet.netlink=31") == 1
+    assert not any(l == "ro.millet.netlink=30" for l in product)
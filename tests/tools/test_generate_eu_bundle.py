@@ -0,0 +1,153 @@
+import json
+import os
+import sys
+import zipfile
+import pytest
+import tools.generate_eu_bundle as bundle_tool
+
+class FakeRom:
+    """Stands in for RomPackage, the ROM is already 'extracted' under tmp_path."""
+    def __init__(self, extracted_dir):
+        self.extracted_dir = extracted_dir
+
+    def extract_images(self, partitions=None):
+        pass
+
+@pytest.fixture
+def rom_tree(tmp_path, monkeypatch):
+    """Creates an extracted ROM with a SAR system partition and a plain product partition."""
+    extracted = tmp_path / "extracted"
+    files = {
+        "system/system/app/Foo/Foo.apk": b"apk" * 1000,
+        "system/system/app/Foo/oat/arm64/Foo.odex": b"odex" * 1000,
+        "product/app/Bar/Bar.apk": b"bar" * 1000,
+        "product/app/Bar/lib/arm64/libbar.so": b"\x7fELF" + b"\0" * 4000,
+        "product/app/Bar/config.xml": b"<config/>" * 100,
+        "product/etc/permissions/bar.xml": b"<permissions/>",
+    }
+    for rel_path, data in files.items():
+        path = extracted / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    # The tool keeps its work dir relative to CWD
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bundle_tool, "RomPackage", lambda *args, **kwargs: FakeRom(extracted))
+    return extracted
+
+@pytest.fixture
+def run_tool(tmp_path, monkeypatch):
+    """Runs main() with the given apps list, returns the expected bundle path."""
+    def run(apps):
+        config = tmp_path / "config.json"
+        config.write_text(json.dumps({"apps": apps}))
+        out_dir = tmp_path / "out"
+        out_dir.mkdir(exist_ok=True)
+        monkeypatch.setattr(sys, "argv", [
+            "generate_eu_bundle.py", "--rom", "rom.zip", "--config", str(config), "--out", str(out_dir)
+        ])
+        bundle_tool.main()
+        return out_dir / "eu_localization_bundle_v1.0.zip"
+    return run
+
+def test_bundle_is_valid(rom_tree, run_tool):
+    out = run_tool(["product/app/Bar", "product/etc/permissions/bar.xml"])
+
+    with zipfile.ZipFile(out) as zf:
+        assert zf.testzip() is None
+        assert zf.read("product/app/Bar/config.xml") == b"<config/>" * 100
+        assert zf.read("product/etc/permissions/bar.xml") == b"<permissions/>"
+
+def test_only_compressed_files_are_stored(rom_tree, run_tool):
+    out = run_tool(["product/app/Bar", "system/app/Foo"])
+
+    with zipfile.ZipFile(out) as zf:
+        assert zf.getinfo("product/app/Bar/Bar.apk").compress_type == zipfile.ZIP_STORED
+        # ELF and dex files are not compressed and still deflate well
+        assert zf.getinfo("product/app/Bar/lib/arm64/libbar.so").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo("system/app/Foo/oat/arm64/Foo.odex").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo("product/app/Bar/config.xml").compress_type == zipfile.ZIP_DEFLATED
+
+def test_sar_paths_are_reparented(rom_tree, run_tool):
+    out = run_tool(["system/app/Foo"])
+
+    with zipfile.ZipFile(out) as zf:
+        assert sorted(zf.namelist()) == ["system/app/Foo/Foo.apk", "system/app/Foo/oat/arm64/Foo.odex"]
+
+def test_overlapping_entries_are_written_once(rom_tree, run_tool):
+    out = run_tool(["product/app", "product/app/Bar", "product/app/Bar/Bar.apk"])
+
+    with zipfile.ZipFile(out) as zf:
+        names = zf.namelist()
+    assert sorted(names) == [
+        "product/app/Bar/Bar.apk", "product/app/Bar/config.xml", "product/app/Bar/lib/arm64/libbar.so"
+    ]
+
+def test_symlinked_directories_are_followed(rom_tree, run_tool, tmp_path):
+    real = tmp_path / "real"
+    real.mkdir()
+    (real / "a.txt").write_text("a")
+    (rom_tree / "product/app/Bar/linked").symlink_to(real, target_is_directory=True)
+
+    with zipfile.ZipFile(run_tool(["product/app/Bar"])) as zf:
+        assert zf.read("product/app/Bar/linked/a.txt") == b"a"
+
+@pytest.mark.parametrize("cpu_count", [1, 4])
+def test_pre_1980_timestamps_are_clamped(rom_tree, run_tool, monkeypatch, cpu_count):
+    monkeypatch.setattr(bundle_tool.os, "cpu_count", lambda: cpu_count)
+    for name in ("Bar.apk", "config.xml"):
+        os.utime(rom_tree / "product/app/Bar" / name, (0, 0))
+
+    with zipfile.ZipFile(run_tool(["product/app/Bar"])) as zf:
+        assert zf.testzip() is None
+        for name in ("Bar.apk", "config.xml"):
+            assert zf.getinfo(f"product/app/Bar/{name}").date_time == (1980, 1, 1, 0, 0, 0)
+
+def test_failed_run_leaves_no_bundle(rom_tree, run_tool, monkeypatch, tmp_path):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(bundle_tool, "pack_bundle", fail)
+
+    out = run_tool(["product/app/Bar"])
+    assert not out.exists()
+    assert list((tmp_path / "out").iterdir()) == []
+
+def pack(out_path, entries):
+    with zipfile.ZipFile(out_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        bundle_tool.pack_bundle(zf, entries)
+    return out_path
+
+@pytest.mark.parametrize("cpu_count", [1, 4])
+def test_pack_bundle_serial_and_parallel(rom_tree, tmp_path, monkeypatch, cpu_count):
+    monkeypatch.setattr(bundle_tool.os, "cpu_count", lambda: cpu_count)
+    entries = bundle_tool.iter_archive_files([(rom_tree / "product", "product", True)])
+    out = pack(tmp_path / "bundle.zip", entries)
+
+    with zipfile.ZipFile(out) as zf:
+        assert zf.testzip() is None
+        assert zf.read("product/app/Bar/config.xml") == b"<config/>" * 100
+        assert zf.getinfo("product/app/Bar/Bar.apk").compress_type == zipfile.ZIP_STORED
+
+def test_zipfile_internals_are_available(tmp_path):
+    # write_deflated_entry mirrors ZipFile internals, fail loudly if a Python update drops them
+    with zipfile.ZipFile(tmp_path / "probe.zip", 'w') as zf:
+        assert bundle_tool.can_splice_entries(zf)
+
+@pytest.mark.parametrize("name", ["Missing.apk", "missing.xml"])
+def test_pack_bundle_raises_on_missing_file(rom_tree, tmp_path, monkeypatch, name):
+    monkeypatch.setattr(bundle_tool.os, "cpu_count", lambda: 4)
+    config = str(rom_tree / "product/app/Bar/config.xml")
+    # Enough entries after the failing one to fill the writer queue
+    entries = [(str(rom_tree / "product/app/Bar" / name), f"product/app/Bar/{name}")]
+    entries += [(config, f"copies/{i}.xml") for i in range(50)]
+
+    with pytest.raises(FileNotFoundError):
+        pack(tmp_path / "bundle.zip", entries)
+
+def test_leading_slash_entries_resolve_in_rom(rom_tree, run_tool):
+    out = run_tool(["/product/app/Bar/", "/system/app/Foo"])
+
+    with zipfile.ZipFile(out) as zf:
+        names = zf.namelist()
+    assert "product/app/Bar/config.xml" in names
+    assert "system/app/Foo/Foo.apk" in names
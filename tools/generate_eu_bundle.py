@@ -1,24 +1,284 @@
 import argparse
+import concurrent.futures
 import json
 import logging
+import os
+import queue
 import shutil
+import stat
+import subprocess
+import threading
+import time
 import zipfile
+import zlib
 import sys
 from pathlib import Path
 
+try:
+    import orjson # Optional, C JSON parser
+except ImportError:
+    orjson = None
+
 # Add project root to sys.path to allow imports
 project_root = Path(__file__).resolve().parent.parent
 sys.path.append(str(project_root))
 
-from src.core.rom import RomPackage
+from src.core.rom import RomPackage, ANDROID_LOGICAL_PARTITIONS
 from src.utils.shell import ShellRunner
 
+# Compressed containers and images gain nothing from deflate, store them as-is.
+# Native libraries (.so), dex/oat output (.odex, .vdex, .oat) and ART images (.art)
+# are not compressed and shrink to roughly half with deflate, so they are left out.
+STORED_SUFFIXES = {".apk", ".jar", ".png", ".jpg", ".webp"}
+
+# Buffer size for per-entry copies (1 MiB) and for the bundle output file (4 MiB)
+COPY_BUFSIZE = 1024 * 1024
+OUTPUT_BUFSIZE = 4 * 1024 * 1024
+
+# Level 1 deflate is several times faster than the default 6 for a few percent of size.
+# Zstandard is not an option: the bundle is read back with the stdlib zipfile.
+COMPRESS_LEVEL = 1
+
+# ZipFile internals needed to splice pre-compressed entries, see write_deflated_entry
+SPLICE_ATTRS = ("_lock", "_seekable", "_writecheck", "_didModify", "fp", "start_dir", "filelist", "NameToInfo")
+
 def setup_logging():
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
+def load_config(path) -> dict:
+    """Parse the bundle config, using orjson when it is installed."""
+    data = Path(path).read_bytes()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def probe_path(path: str):
+    """Stat a candidate path once. Returns (path, stat_result), or (None, None) if missing."""
+    try:
+        return path, os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None, None
+
+def find_sar_roots(extracted_root: str, partitions) -> dict:
+    """Map each partition to its nested SAR root (extracted/system/system), if the ROM has one."""
+    sar_roots = {}
+    for partition in partitions:
+        sar_root = os.path.join(extracted_root, partition, partition)
+        if os.path.isdir(sar_root):
+            sar_roots[partition] = sar_root
+    return sar_roots
+
+def resolve_app(app_path_str: str, extracted_root: str, sar_roots: dict):
+    """
+    Locate one app in the extracted ROM.
+    Works on plain strings to avoid building several Path objects per app.
+    sar_roots comes from find_sar_roots, so SAR layouts are only probed where they exist.
+    app_path_str must already be normalised (no leading or trailing "/").
+    Returns (src_path, is_dir), or None if the app is missing.
+    """
+    # app_path_str e.g. "product/app/MiuiCamera"
+    # We need to find this in the extracted ROM
+    
+    # Logic: Split path into partition and relative path
+    # e.g. "system/app/Foo" -> part="system", rest="app/Foo"
+    partition, _, relative_path = app_path_str.partition("/")
+    if not partition: return None
+    
+    # Search candidate paths, keeping the stat result so the type check below needs no extra syscall
+    # Standard: extracted/system/app/Foo, SAR: extracted/system/system/app/Foo
+    found_src, found_st = probe_path(os.path.join(extracted_root, app_path_str))
+    if found_src is None and partition in sar_roots:
+        found_src, found_st = probe_path(os.path.join(sar_roots[partition], relative_path))
+    
+    if found_src is None:
+        return None
+    return found_src, stat.S_ISDIR(found_st.st_mode)
+
+def make_zipinfo(arcname, st, strict_timestamps=True) -> zipfile.ZipInfo:
+    """
+    ZipInfo.from_file, but from a stat result of an already open file.
+    With strict_timestamps=False, mtimes the zip format cannot hold are clamped
+    (as ZipFile does) instead of raising.
+    """
+    date_time = time.localtime(st.st_mtime)[0:6]
+    if not strict_timestamps:
+        # ROM files commonly carry pre-1980 timestamps
+        if date_time[0] < 1980:
+            date_time = (1980, 1, 1, 0, 0, 0)
+        elif date_time[0] > 2107:
+            date_time = (2107, 12, 31, 23, 59, 59)
+    arcname = os.path.normpath(os.path.splitdrive(arcname)[1]).lstrip(os.sep + (os.altsep or ""))
+    zinfo = zipfile.ZipInfo(arcname, date_time)
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    return zinfo
+
+def write_zip_entry(zf: zipfile.ZipFile, file_path, arcname, compress_type, strict_timestamps=True):
+    """
+    Stream one file into the archive.
+    Same as ZipFile.write, but copies with a 1 MiB buffer instead of 8 KiB
+    and takes the metadata from fstat on the open file rather than another path lookup.
+    """
+    with open(file_path, 'rb') as src:
+        zinfo = make_zipinfo(arcname, os.fstat(src.fileno()), strict_timestamps)
+        zinfo.compress_type = compress_type
+        # ZipFile.write applies the archive-wide level, ZipFile.open takes it from the ZipInfo
+        zinfo._compresslevel = zf.compresslevel
+        with zf.open(zinfo, 'w') as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+def iter_archive_files(to_archive):
+    """
+    Yield (file_path, arcname) for every file of the resolved apps.
+    Always maps to the simple structure (system/app/Foo) regardless of ROM layout.
+    """
+    seen = set()
+    for src, prefix, is_dir in to_archive:
+        if not is_dir:
+            candidates = [(src, prefix)]
+        else:
+            candidates = []
+            # os.walk classifies entries from readdir d_type, no extra stat per file
+            # Follow symlinked subdirectories, like the staging copytree used to
+            for root, _, files in os.walk(src, followlinks=True):
+                # Resolve the archive prefix once per directory rather than per file
+                rel_root = os.path.relpath(root, src)
+                arc_root = prefix if rel_root == os.curdir else os.path.join(prefix, rel_root)
+                candidates.extend((os.path.join(root, name), os.path.join(arc_root, name)) for name in files)
+        
+        for file_path, arcname in candidates:
+            # Overlapping config entries (e.g. "system/app" and "system/app/Foo") share files.
+            # Config prefixes use "/" while os.path.join uses os.sep, compare one form
+            arcname = arcname.replace(os.sep, "/")
+            if arcname not in seen:
+                seen.add(arcname)
+                yield file_path, arcname
+
+def deflate_file(file_path, level):
+    """
+    Raw-deflate one file (worker thread side, zlib releases the GIL while compressing).
+    Returns (stat_result, crc32, file_size, compressed_bytes).
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc, file_size, chunks = 0, 0, []
+    with open(file_path, 'rb') as f:
+        # fstat on the open file, so the writer needs no path lookup for the metadata
+        st = os.fstat(f.fileno())
+        while chunk := f.read(COPY_BUFSIZE):
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return st, crc, file_size, b"".join(chunks)
+
+def can_splice_entries(zf: zipfile.ZipFile) -> bool:
+    """Whether this zipfile still has the internals write_deflated_entry relies on."""
+    return all(hasattr(zf, attr) for attr in SPLICE_ATTRS)
+
+def write_deflated_entry(zf: zipfile.ZipFile, arcname, st, crc, file_size, data, strict_timestamps=True):
+    """
+    Splice pre-compressed deflate data into the archive.
+    zipfile has no public API for this, so mirror what ZipFile.mkdir does internally
+    (checked against CPython 3.10-3.13); callers fall back to write_zip_entry
+    when can_splice_entries() is False.
+    """
+    zinfo = make_zipinfo(arcname, st, strict_timestamps)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = len(data)
+
+    with zf._lock:
+        if zf._seekable:
+            zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.fp.write(zinfo.FileHeader())
+        zf.fp.write(data)
+        zf.start_dir = zf.fp.tell()
+
+def entry_compress_type(file_path) -> int:
+    """Already-compressed payloads are stored, everything else is deflated."""
+    if os.path.splitext(file_path)[1].lower() in STORED_SUFFIXES:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def pack_bundle(zf: zipfile.ZipFile, entries, strict_timestamps=True):
+    """
+    Write (file_path, arcname) entries into the archive, reading straight from the extracted ROM.
+    Deflate is CPU bound, so those entries are compressed on a thread pool. A writer thread
+    appends entries (in submission order) while this thread keeps the pool fed, so
+    streaming a large stored APK does not leave the workers idle.
+    strict_timestamps is passed on to make_zipinfo.
+    """
+    max_workers = os.cpu_count() or 1
+    if max_workers == 1 or not can_splice_entries(zf):
+        # Nothing to run in parallel (or no way to splice), a pool would only add overhead
+        for file_path, arcname in entries:
+            write_zip_entry(zf, file_path, arcname, entry_compress_type(file_path), strict_timestamps)
+        return
+    
+    # Bound in-flight results so compressed data does not pile up in memory
+    pending = queue.Queue(maxsize=max_workers * 2)
+    errors = []
+    
+    def write_pending():
+        while (item := pending.get()) is not None:
+            # After a failure keep draining so the producer never blocks on a full queue
+            if errors:
+                continue
+            file_path, arcname, future = item
+            try:
+                if future is None:
+                    write_zip_entry(zf, file_path, arcname, zipfile.ZIP_STORED, strict_timestamps)
+                else:
+                    write_deflated_entry(zf, arcname, *future.result(), strict_timestamps=strict_timestamps)
+            except BaseException as e:
+                errors.append(e)
+    
+    writer = threading.Thread(target=write_pending, name="BundleWriter")
+    writer.start()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for file_path, arcname in entries:
+                if errors:
+                    break
+                future = None
+                if entry_compress_type(file_path) == zipfile.ZIP_DEFLATED:
+                    future = executor.submit(deflate_file, file_path, zf.compresslevel)
+                pending.put((file_path, arcname, future))
+        finally:
+            pending.put(None)
+            writer.join()
+    
+    if errors:
+        raise errors[0]
+
+def remove_tree_in_background(path: Path):
+    """
+    Rename path aside and delete it without blocking the caller.
+    Falls back to a synchronous rmtree if it cannot be renamed.
+    """
+    trash = path.with_name(f"{path.name}.trash.{os.getpid()}")
+    try:
+        os.rename(path, trash)
+    except OSError:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    
+    if os.name == "posix":
+        subprocess.Popen(["rm", "-rf", str(trash)], start_new_session=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        # Non-daemon, so the interpreter still waits for the delete before exiting
+        threading.Thread(target=shutil.rmtree, args=(trash,), kwargs={"ignore_errors": True}).start()
+
 def main():
     setup_logging()
     logger = logging.getLogger("BundleGen")
@@ -28,6 +288,8 @@ def main():
     parser.add_argument("--config", required=True, help="Path to JSON config defining apps to extract")
     parser.add_argument("--version", default="1.0", help="Version tag for the bundle")
     parser.add_argument("--out", default=".", help="Output directory")
+    parser.add_argument("--compress-level", type=int, default=COMPRESS_LEVEL, choices=range(0, 10),
+                        metavar="0-9", help=f"Deflate level (default: {COMPRESS_LEVEL}, fastest)")
     args = parser.parse_args()
 
     work_dir = Path("build_bundle_temp").resolve()
@@ -37,71 +299,59 @@ def main():
 
     try:
         # 1. Load Config
-        with open(args.config, 'r') as f:
-            config = json.load(f)
+        config = load_config(args.config)
         
         apps_list = config.get("apps", [])
         if not apps_list:
             logger.error("No apps defined in config file.")
             return
+        if not isinstance(apps_list, list) or not all(isinstance(a, str) for a in apps_list):
+            logger.error("'apps' must be a list of path strings.")
+            return
+        # Normalise once ("/product/app/Bar/" -> "product/app/Bar"): a leading "/" would make
+        # os.path.join probe the host filesystem instead of the extracted ROM
+        apps_list = [app_path_str.strip("/") for app_path_str in apps_list]
+        # Hand-curated lists may repeat entries, keep the first occurrence of each
+        apps_list = list(dict.fromkeys(apps_list))
+
+        # Determine which partitions we need to mount/extract based on config
+        # Only partitions that actually hold a requested app are worth extracting,
+        # and a typo should fail before the (slow) extraction rather than after
+        partitions_to_extract = sorted({
+            app_path_str.partition("/")[0] for app_path_str in apps_list
+        } - {""})
+        unknown = [p for p in partitions_to_extract if p not in ANDROID_LOGICAL_PARTITIONS]
+        if unknown:
+            logger.error(f"Config references unknown partitions: {unknown}")
+            return
 
         # 2. Extract ROM
         logger.info(f"Extracting Source ROM: {args.rom}")
         rom = RomPackage(args.rom, work_dir / "rom_extract", label="Source")
-        
-        # Determine which partitions we need to mount/extract based on config
-        # Simply extract common system partitions to be safe
-        partitions_to_extract = ["system", "product", "system_ext", "mi_ext"]
         rom.extract_images(partitions_to_extract)
 
         # 3. Harvest Apps
-        bundle_root = work_dir / "bundle_root"
-        bundle_root.mkdir(parents=True)
+        # Nothing is copied: apps are resolved here and zipped straight from the
+        # extracted ROM, arcnames re-parent SAR paths at write time
+        extracted_root = str(rom.extracted_dir)
         
-        extracted_root = rom.extracted_dir
+        sar_roots = find_sar_roots(extracted_root, partitions_to_extract)
         
-        count = 0
+        to_archive = []
         for app_path_str in apps_list:
-            # app_path_str e.g. "product/app/MiuiCamera"
-            # We need to find this in the extracted ROM
-            
-            # Logic: Split path into partition and relative path
-            # e.g. "system/app/Foo" -> part="system", rest="app/Foo"
-            parts = Path(app_path_str).parts
-            if not parts: continue
-            
-            partition = parts[0] # system, product, etc.
-            relative_path = Path(*parts[1:])
-            
-            # Search candidate paths
-            candidates = [
-                extracted_root / app_path_str,                         # Standard: extracted/system/app/Foo
-                extracted_root / partition / partition / relative_path # SAR: extracted/system/system/app/Foo
-            ]
-            
-            found_src = None
-            for candidate in candidates:
-                if candidate.exists():
-                    found_src = candidate
-                    break
-            
-            if not found_src:
+            resolved = resolve_app(app_path_str, extracted_root, sar_roots)
+            if resolved is None:
                 logger.warning(f"App not found: {app_path_str}")
                 continue
-                
-            # 2. Copy to bundle root, preserving structure
-            # Always map to the simple structure (bundle_root/system/app/Foo)
-            dest_path = bundle_root / app_path_str
-            dest_path.parent.mkdir(parents=True, exist_ok=True)
             
-            if found_src.is_dir():
-                if dest_path.exists(): shutil.rmtree(dest_path)
-                shutil.copytree(found_src, dest_path)
-            else:
-                shutil.copy2(found_src, dest_path)
-            
-            logger.info(f"Collected: {app_path_str}")
-            count += 1
+            found_src, is_dir = resolved
+            to_archive.append((found_src, app_path_str, is_dir))
+            logger.debug(f"Collected: {app_path_str}")
+        
+        count = len(to_archive)
+        if count:
+            collected = "\n  ".join(app_path_str for _, app_path_str, _ in to_archive)
+            logger.info(f"Collected {count} apps:\n  {collected}")
 
         if count == 0:
             logger.error("No apps collected! Check your config and ROM.")
@@ -110,23 +360,32 @@ def main():
         # 4. Pack Bundle
         out_name = f"eu_localization_bundle_v{args.version}.zip"
         out_path = Path(args.out).resolve() / out_name
+        # The only directory this tool creates besides its work dir
+        out_path.parent.mkdir(parents=True, exist_ok=True)
         
         logger.info(f"Zipping bundle to {out_path}...")
         
-        with zipfile.ZipFile(out_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-            for file_path in bundle_root.rglob("*"):
-                if file_path.is_file():
-                    arcname = file_path.relative_to(bundle_root)
-                    zf.write(file_path, arcname)
+        # Write under a temporary name so a failed run never leaves a broken bundle behind
+        tmp_out_path = out_path.with_name(f"{out_name}.tmp")
+        try:
+            # A large write buffer batches the many small zip writes
+            with open(tmp_out_path, 'wb', buffering=OUTPUT_BUFSIZE) as raw, \
+                 zipfile.ZipFile(raw, 'w', compression=zipfile.ZIP_DEFLATED,
+                                 compresslevel=args.compress_level, allowZip64=True) as zf:
+                # ROM files commonly carry pre-1980 mtimes, clamp them rather than abort
+                pack_bundle(zf, iter_archive_files(to_archive), strict_timestamps=False)
+            os.replace(tmp_out_path, out_path)
+        finally:
+            tmp_out_path.unlink(missing_ok=True)
         
         logger.info("Done!")
 
     except Exception as e:
         logger.error(f"Error: {e}", exc_info=True)
     finally:
-        # Cleanup
+        # Cleanup, the bundle is already written so don't make the user wait for it
         if work_dir.exists():
-            shutil.rmtree(work_dir)
+            remove_tree_in_background(work_dir)
 
 if __name__ == "__main__":
     main()